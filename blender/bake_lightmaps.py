@@ -1,7 +1,14 @@
 # bake_lightmaps.py (Version 10 - Logging & Optimizations)
 
+import atexit
+import bmesh
 import bpy
+import logging
+import logging.handlers
+import numpy as np
 import os
+import queue
+import sys
 import time
 
 # --- CONFIGURATION ---
@@ -10,7 +17,8 @@ LIGHTS_ON_COLLECTION_NAME = "Lights_ON"
 LIGHTS_OFF_COLLECTION_NAME = "Lights_OFF"
 LIGHTMAP_UV_NAME = "LightmapUV"
 IMAGE_RESOLUTION = 4096  # Increased from 2048 for better quality
-OUTPUT_IMAGE_FORMAT = 'PNG'
+OUTPUT_IMAGE_FORMAT = 'PNG'  # 'PNG' for the web build, 'OPEN_EXR' writes half-float EXR (smaller, faster to encode)
+OUTPUT_IMAGE_EXTENSION = 'exr' if OUTPUT_IMAGE_FORMAT == 'OPEN_EXR' else OUTPUT_IMAGE_FORMAT.lower()
 
 blend_file_path = bpy.data.filepath
 output_directory = os.path.dirname(blend_file_path)
@@ -18,6 +26,8 @@ output_directory = os.path.dirname(blend_file_path)
 # --- BAKE PERFORMANCE SETTINGS ---
 RENDER_SAMPLES = 64
 USE_DENOISE = True
+OFF_BAKE_SAMPLES = RENDER_SAMPLES // 4  # Lights-off pass has little high-frequency light, fewer samples are enough
+OFF_BAKE_DENOISE = USE_DENOISE  # Denoising is cheap next to path tracing and hides the lower sample count
 MAX_LIGHT_BOUNCES = 6  # Increased from 2 to 6 for better light distribution
 BAKE_MARGIN_PX = 16  # Margin around UV islands to prevent bleeding (increased from 8)
 UV_ISLAND_MARGIN = 0.02  # Margin between UV islands (increased from 0.01 to prevent bleeding)
@@ -29,60 +39,121 @@ WORLD_LIGHT_COLOR = (0.8, 0.85, 0.9)  # Slight blue tint (daylight color)
 # --- EXPORT SETTINGS ---
 AUTO_EXPORT_GLB = True  # Automatically export GLB after baking
 EXPORT_FILENAME = "Mansion.glb"  # Output GLB filename
+EXPORT_USE_DRACO = False  # Disabled for compatibility; settings below apply when enabled
+DRACO_COMPRESSION_LEVEL = 5  # Level 5 encodes much faster than the default 6 at similar size
+DRACO_POSITION_QUANTIZATION = 11
+DRACO_NORMAL_QUANTIZATION = 8
+DRACO_TEXCOORD_QUANTIZATION = 12  # Keep lightmap UVs precise to avoid seams
+DRACO_GENERIC_QUANTIZATION = 10
 
 # --- LOGGING SETTINGS ---
 ENABLE_CONSOLE_LOGGING = True  # Set to False to disable console output
 ENABLE_FILE_LOGGING = True  # Set to True to log to file
 LOG_FILE_PATH = os.path.join(output_directory, "lightmap_bake.log")
+LOG_LEVEL = 'INFO'  # 'DEBUG' adds per-object progress lines, 'WARN' shows only warnings and errors
+VERIFY_UV_QUALITY = False  # Log UV bounds/coverage checks after unwrapping and repacking
 
 # --- END OF CONFIGURATION ---
 
 # --- LOGGING SYSTEM ---
+DEBUG = logging.DEBUG
+INFO = logging.INFO
+WARN = logging.WARNING
+LOG_LEVELS = {'DEBUG': DEBUG, 'INFO': INFO, 'WARN': WARN, 'WARNING': WARN}
+LOG_TIMESTAMP_FORMAT = '%Y-%m-%d %H:%M:%S'
+
 class Logger:
-    def __init__(self, console_enabled=True, file_enabled=False, file_path=None):
+    """
+    Thin wrapper over stdlib logging. Records are queued on the calling
+    (Blender) thread and written to console/file by a QueueListener thread.
+    """
+    def __init__(self, console_enabled=True, file_enabled=False, file_path=None, min_level=INFO):
         self.console_enabled = console_enabled
         self.file_enabled = file_enabled
         self.file_path = file_path
-        self.log_file = None
+        self.min_level = min_level
+        self.listener = None
 
-        if self.file_enabled and self.file_path:
-            self.log_file = open(self.file_path, 'w', encoding='utf-8')
-            self.log(f"Lightmap baking log started at {time.strftime('%Y-%m-%d %H:%M:%S')}\n")
+        self._logger = logging.getLogger("bake_lightmaps")
+        self._logger.setLevel(min_level)
+        self._logger.propagate = False
+        # Blender keeps the logging registry between script runs, drop stale handlers
+        for handler in self._logger.handlers[:]:
+            self._logger.removeHandler(handler)
 
-    def log(self, message):
+        handlers = []
         if self.console_enabled:
-            print(message)
-        if self.file_enabled and self.log_file:
-            self.log_file.write(message + '\n')
-            self.log_file.flush()
+            handlers.append(logging.StreamHandler(sys.stdout))
+        if self.file_enabled and self.file_path:
+            # FileHandler flushes every record on the listener thread. That thread
+            # only runs while the main thread releases the GIL, so call flush()
+            # before long C operators to get pending lines on disk first
+            handlers.append(logging.FileHandler(self.file_path, mode='w', encoding='utf-8'))
+
+        if not handlers:
+            # Nothing to write to: make every level "disabled" so log() and
+            # enabled(DEBUG) guards return before any message is formatted
+            self.min_level = logging.CRITICAL + 1
+            self._logger.addHandler(logging.NullHandler())
+            return
+
+        log_queue = queue.SimpleQueue()
+        self._logger.addHandler(logging.handlers.QueueHandler(log_queue))
+        self.listener = logging.handlers.QueueListener(log_queue, *handlers)
+        self.listener.start()
+        self.log(f"Lightmap baking log started at {time.strftime(LOG_TIMESTAMP_FORMAT)}\n")
+
+    def enabled(self, level):
+        return level >= self.min_level
+
+    def log(self, message, level=INFO):
+        if level >= self.min_level:
+            self._logger.log(level, message)
+
+    def flush(self):
+        """Write out every queued record now (stop() drains the queue, then restart)"""
+        if self.listener:
+            self.listener.stop()
+            self.listener.start()
 
     def close(self):
-        if self.log_file:
-            self.log(f"\nLog ended at {time.strftime('%Y-%m-%d %H:%M:%S')}")
-            self.log_file.close()
+        if self.listener:
+            self.log(f"\nLog ended at {time.strftime(LOG_TIMESTAMP_FORMAT)}")
+            # stop() drains the queue before returning
+            self.listener.stop()
+            for handler in self.listener.handlers:
+                handler.close()
+            self.listener = None
 
 # Initialize logger
 logger = Logger(
     console_enabled=ENABLE_CONSOLE_LOGGING,
     file_enabled=ENABLE_FILE_LOGGING,
-    file_path=LOG_FILE_PATH
+    file_path=LOG_FILE_PATH,
+    min_level=LOG_LEVELS.get(str(LOG_LEVEL).upper(), INFO)
 )
+atexit.register(logger.close)
+if str(LOG_LEVEL).upper() not in LOG_LEVELS:
+    logger.log(f"Unknown LOG_LEVEL '{LOG_LEVEL}', using 'INFO' (choose from {', '.join(LOG_LEVELS)})", WARN)
 
 def get_all_mesh_objects_in_collection(collection_name):
     mesh_objects = []
     collection = bpy.data.collections.get(collection_name)
     if not collection:
-        logger.log(f"Error: Collection '{collection_name}' not found.")
+        logger.log(f"Error: Collection '{collection_name}' not found.", WARN)
         return []
 
-    def find_meshes(coll):
+    # Iterative walk; objects linked into several sub-collections are kept once
+    seen = set()
+    stack = [collection]
+    while stack:
+        coll = stack.pop()
+        stack.extend(reversed(coll.children))  # Keep depth-first collection order
         for obj in coll.objects:
-            if obj.type == 'MESH':
+            if obj.type == 'MESH' and obj.name_full not in seen:
+                seen.add(obj.name_full)
                 mesh_objects.append(obj)
-        for sub_coll in coll.children:
-            find_meshes(sub_coll)
 
-    find_meshes(collection)
     logger.log(f"Found {len(mesh_objects)} mesh objects in '{collection_name}'.")
     return mesh_objects
 
@@ -169,30 +240,45 @@ def unwrap_original_objects(objects):
 
 
 def apply_modifiers(objects):
+    """
+    Bake each object's viewport modifier stack into its mesh data using the
+    evaluated depsgraph (one evaluation per object, no operator calls).
+    """
     logger.log("\n--- Starting Modifier Application ---")
-    bpy.ops.object.select_all(action='DESELECT')
 
     total_objects = len(objects)
     for idx, obj in enumerate(objects, 1):
-        bpy.context.view_layer.objects.active = obj
-        obj.select_set(True)
+        active_modifiers = [modifier for modifier in obj.modifiers if modifier.show_viewport]
 
-        if obj.data.users > 1:
-            logger.log(f"  Making mesh data for '{obj.name}' unique ({idx}/{total_objects})...")
-            obj.data = obj.data.copy()
+        if not active_modifiers:
+            if obj.data.users > 1:
+                if logger.enabled(DEBUG):
+                    logger.log(f"  Making mesh data for '{obj.name}' unique ({idx}/{total_objects})...", DEBUG)
+                obj.data = obj.data.copy()
+            continue
 
-        modifier_count = len(obj.modifiers)
-        if modifier_count > 0:
-            logger.log(f"  Applying {modifier_count} modifier(s) to {obj.name} ({idx}/{total_objects})...")
+        if logger.enabled(DEBUG):
+            logger.log(f"  Applying {len(active_modifiers)} modifier(s) to {obj.name} ({idx}/{total_objects})...", DEBUG)
 
-        for modifier in reversed(obj.modifiers[:]):
-            if modifier.show_viewport:
-                try:
-                    bpy.ops.object.modifier_apply(modifier=modifier.name)
-                except RuntimeError as e:
-                    logger.log(f"    Could not apply '{modifier.name}'. Error: {e}")
+        try:
+            # Re-fetched per object so edits to earlier objects are evaluated
+            depsgraph = bpy.context.evaluated_depsgraph_get()
+            evaluated_obj = obj.evaluated_get(depsgraph)
+            new_mesh = bpy.data.meshes.new_from_object(
+                evaluated_obj, preserve_all_data_layers=True, depsgraph=depsgraph
+            )
+        except RuntimeError as e:
+            logger.log(f"    Could not apply modifiers on '{obj.name}'. Error: {e}", WARN)
+            continue
 
-        obj.select_set(False)
+        old_mesh = obj.data
+        obj.data = new_mesh
+        for modifier in active_modifiers:
+            obj.modifiers.remove(modifier)
+
+        # Shared meshes are still used by other objects, only drop orphans
+        if old_mesh.users == 0:
+            bpy.data.meshes.remove(old_mesh)
 
     logger.log("--- Modifier Application Complete ---")
 
@@ -226,12 +312,13 @@ def join_objects(objects):
         uv_layers = [layer.name for layer in sample_dup.data.uv_layers]
         logger.log(f"  Duplicate UV layers: {uv_layers}")
         if LIGHTMAP_UV_NAME not in uv_layers:
-            logger.log(f"  ⚠️ WARNING: LightmapUV not found in duplicates!")
+            logger.log(f"  ⚠️ WARNING: LightmapUV not found in duplicates!", WARN)
 
     # Now join the duplicates
     bpy.context.view_layer.objects.active = duplicates[0]
 
     logger.log(f"  Joining {len(duplicates)} duplicates into one mesh for baking...")
+    logger.flush()
     bpy.ops.object.join()
 
     joined_object = bpy.context.active_object
@@ -272,13 +359,26 @@ def join_objects(objects):
     return [joined_object], objects
 
 
+def get_uv_bounds(uv_layer):
+    """Return (min_u, max_u, min_v, max_v) over every UV in the layer"""
+    if len(uv_layer.data) == 0:
+        return float('inf'), float('-inf'), float('inf'), float('-inf')
+
+    uvs = np.empty(len(uv_layer.data) * 2, dtype=np.float32)
+    uv_layer.data.foreach_get("uv", uvs)
+    uvs = uvs.reshape(-1, 2)
+    min_uv = uvs.min(axis=0)
+    max_uv = uvs.max(axis=0)
+    return float(min_uv[0]), float(max_uv[0]), float(min_uv[1]), float(max_uv[1])
+
+
 def repack_joined_lightmap_uvs(joined_obj):
     """
     CRITICAL: Repack all individual UV islands into shared 0-1 space.
     Without this, each object's UVs overlap (all in 0-1 independently).
     """
     logger.log("\n--- Repacking Joined Lightmap UVs ---")
-    logger.log("  ⚠️ Individual object UVs overlap - repacking into shared space...")
+    logger.log("  ⚠️ Individual object UVs overlap - repacking into shared space...", WARN)
 
     if joined_obj.type != 'MESH':
         logger.log("  Not a mesh object, skipping")
@@ -286,7 +386,7 @@ def repack_joined_lightmap_uvs(joined_obj):
 
     # Ensure LightmapUV is active
     if LIGHTMAP_UV_NAME not in joined_obj.data.uv_layers:
-        logger.log(f"  ❌ No {LIGHTMAP_UV_NAME} layer found!")
+        logger.log(f"  ❌ No {LIGHTMAP_UV_NAME} layer found!", WARN)
         return
 
     joined_obj.data.uv_layers[LIGHTMAP_UV_NAME].active = True
@@ -306,67 +406,59 @@ def repack_joined_lightmap_uvs(joined_obj):
         bpy.ops.uv.pack_islands(margin=UV_ISLAND_MARGIN)
         logger.log("  ✅ UV islands repacked successfully")
     except Exception as e:
-        logger.log(f"  ⚠️ UV packing failed: {e}")
+        logger.log(f"  ⚠️ UV packing failed: {e}", WARN)
         logger.log("  Trying alternative pack method...")
         try:
             bpy.ops.uv.pack_islands(udim_source='CLOSEST_UDIM', margin=UV_ISLAND_MARGIN)
             logger.log("  ✅ Alternative pack succeeded")
         except Exception as e2:
-            logger.log(f"  ❌ All packing methods failed: {e2}")
+            logger.log(f"  ❌ All packing methods failed: {e2}", WARN)
 
     bpy.ops.object.mode_set(mode='OBJECT')
 
-    # Verify the repacking
-    logger.log("\n  📊 Verifying repacked UVs...")
-    uv_layer = joined_obj.data.uv_layers[LIGHTMAP_UV_NAME]
-    min_u, max_u = float('inf'), float('-inf')
-    min_v, max_v = float('inf'), float('-inf')
-
-    for uv in uv_layer.data:
-        min_u = min(min_u, uv.uv[0])
-        max_u = max(max_u, uv.uv[0])
-        min_v = min(min_v, uv.uv[1])
-        max_v = max(max_v, uv.uv[1])
+    # Verify the repacking (optional, see VERIFY_UV_QUALITY)
+    if VERIFY_UV_QUALITY:
+        logger.log("\n  📊 Verifying repacked UVs...")
+        uv_layer = joined_obj.data.uv_layers[LIGHTMAP_UV_NAME]
+        min_u, max_u, min_v, max_v = get_uv_bounds(uv_layer)
 
-    coverage = (max_u - min_u) * (max_v - min_v)
-    logger.log(f"     UV bounds: U[{min_u:.3f}, {max_u:.3f}] V[{min_v:.3f}, {max_v:.3f}]")
-    logger.log(f"     Coverage: {coverage:.1%} of texture space")
+        coverage = (max_u - min_u) * (max_v - min_v)
+        logger.log(f"     UV bounds: U[{min_u:.3f}, {max_u:.3f}] V[{min_v:.3f}, {max_v:.3f}]")
+        logger.log(f"     Coverage: {coverage:.1%} of texture space")
 
-    if coverage > 0.5:
-        logger.log("     ✅ Good UV coverage after repacking")
-    else:
-        logger.log("     ⚠️ Low UV coverage - islands might be too small")
+        if coverage > 0.5:
+            logger.log("     ✅ Good UV coverage after repacking")
+        else:
+            logger.log("     ⚠️ Low UV coverage - islands might be too small", WARN)
 
     logger.log("--- UV Repacking Complete ---")
 
 
 def cleanup_meshes(objects):
+    """
+    Merge by distance, recalculate outside normals and triangulate, all on
+    one bmesh per object instead of three edit-mode operator passes.
+    """
     logger.log("\n--- Starting Mesh Cleanup ---")
-    bpy.ops.object.select_all(action='DESELECT')
 
     if not objects:
         logger.log("  No objects to clean.")
         return
 
+    logger.log("  Merging vertices, recalculating outside normals, triangulating all faces...")
     for obj in objects:
-        obj.select_set(True)
-    
-    bpy.context.view_layer.objects.active = objects[0]
+        mesh = obj.data
+        bm = bmesh.new()
+        bm.from_mesh(mesh)
 
-    bpy.ops.object.mode_set(mode='EDIT')
-    bpy.ops.mesh.select_all(action='SELECT')
-    
-    logger.log("  Merging vertices by distance...")
-    bpy.ops.mesh.remove_doubles(threshold=0.0001)
-    
-    logger.log("  Recalculating outside normals...")
-    bpy.ops.mesh.normals_make_consistent(inside=False)
-    
-    logger.log("  Triangulating all faces...")
-    bpy.ops.mesh.quads_convert_to_tris()
+        bmesh.ops.remove_doubles(bm, verts=bm.verts[:], dist=0.0001)
+        bmesh.ops.recalc_face_normals(bm, faces=bm.faces[:])
+        bmesh.ops.triangulate(bm, faces=bm.faces[:])
+
+        bm.to_mesh(mesh)
+        bm.free()
+        mesh.update()
 
-    bpy.ops.object.mode_set(mode='OBJECT')
-    bpy.ops.object.select_all(action='DESELECT')
     logger.log("--- Mesh Cleanup Complete ---")
 
 
@@ -396,12 +488,7 @@ def setup_uvs(objects):
     logger.log(f"  Keeping original UV layer: {original_uv_name}")
 
     # Remove ALL other UV layers (map1, LightmapUV, etc.)
-    layers_to_remove = []
-    for i, layer in enumerate(mesh.uv_layers):
-        if i > 0:  # Keep only the first layer
-            layers_to_remove.append(layer)
-
-    for layer in layers_to_remove:
+    for layer in list(mesh.uv_layers)[1:]:  # Keep only the first layer
         logger.log(f"  Removing extra UV layer: {layer.name}")
         mesh.uv_layers.remove(layer)
 
@@ -426,6 +513,7 @@ def setup_uvs(objects):
     logger.log("  Unwrapping with Smart UV Project (handles large meshes)...")
     logger.log(f"  UV island margin: {UV_ISLAND_MARGIN}")
 
+    logger.flush()
     try:
         # Smart UV Project with angle-based island creation
         bpy.ops.uv.smart_project(
@@ -439,17 +527,18 @@ def setup_uvs(objects):
 
         # Pack islands for optimal space usage
         logger.log("  Packing UV islands for optimal coverage...")
+        logger.flush()
         bpy.ops.uv.pack_islands(margin=UV_ISLAND_MARGIN)
         logger.log("  ✅ UV packing completed")
 
     except Exception as e:
-        logger.log(f"  ❌ Smart UV Project failed: {e}")
+        logger.log(f"  ❌ Smart UV Project failed: {e}", WARN)
         logger.log("  Trying basic angle-based unwrap as fallback...")
         try:
             bpy.ops.uv.unwrap(method='ANGLE_BASED', margin=UV_ISLAND_MARGIN)
             logger.log("  ✅ Basic unwrap completed")
         except Exception as e2:
-            logger.log(f"  ❌ All UV unwrapping methods failed: {e2}")
+            logger.log(f"  ❌ All UV unwrapping methods failed: {e2}", WARN)
 
     bpy.ops.object.mode_set(mode='OBJECT')
     bpy.ops.object.select_all(action='DESELECT')
@@ -458,27 +547,14 @@ def setup_uvs(objects):
     for i, uv_layer in enumerate(mesh.uv_layers):
         logger.log(f"     Layer {i}: {uv_layer.name} {'(active render)' if uv_layer.active_render else ''}")
 
-    # ENHANCED UV unwrap quality verification
-    logger.log("\n  📊 Verifying UV unwrap quality...")
-    if LIGHTMAP_UV_NAME in mesh.uv_layers:
+    # ENHANCED UV unwrap quality verification (optional, see VERIFY_UV_QUALITY)
+    if VERIFY_UV_QUALITY and LIGHTMAP_UV_NAME in mesh.uv_layers:
+        logger.log("\n  📊 Verifying UV unwrap quality...")
         uv_layer = mesh.uv_layers[LIGHTMAP_UV_NAME]
         uv_count = len(uv_layer.data)
 
-        # Check UV bounds and distribution
-        min_u, max_u = float('inf'), float('-inf')
-        min_v, max_v = float('inf'), float('-inf')
-
-        # Sample multiple UVs to check distribution
-        uv_samples = []
-        sample_count = min(100, uv_count)
-        for i in range(sample_count):
-            idx = int(i * (uv_count / sample_count))
-            uv = uv_layer.data[idx].uv
-            uv_samples.append((uv[0], uv[1]))
-            min_u = min(min_u, uv[0])
-            max_u = max(max_u, uv[0])
-            min_v = min(min_v, uv[1])
-            max_v = max(max_v, uv[1])
+        # Check UV bounds and distribution (all UVs, not a sample)
+        min_u, max_u, min_v, max_v = get_uv_bounds(uv_layer)
 
         logger.log(f"     UV coordinates: {uv_count}")
         logger.log(f"     UV bounds: U[{min_u:.3f}, {max_u:.3f}] V[{min_v:.3f}, {max_v:.3f}]")
@@ -491,11 +567,11 @@ def setup_uvs(objects):
 
         # Validation checks
         if coverage_u < 0.1 or coverage_v < 0.1:
-            logger.log("     ❌ CRITICAL: UVs are collapsed! Unwrap failed!")
+            logger.log("     ❌ CRITICAL: UVs are collapsed! Unwrap failed!", WARN)
         elif total_coverage < 0.1:
-            logger.log("     ⚠️ WARNING: Very low UV coverage - islands might be too small!")
+            logger.log("     ⚠️ WARNING: Very low UV coverage - islands might be too small!", WARN)
         elif min_u < -0.1 or max_u > 1.1 or min_v < -0.1 or max_v > 1.1:
-            logger.log("     ⚠️ WARNING: Some UVs outside 0-1 range!")
+            logger.log("     ⚠️ WARNING: Some UVs outside 0-1 range!", WARN)
         elif total_coverage > 0.5:
             logger.log("     ✅ Excellent UV unwrap! Good coverage.")
         else:
@@ -504,8 +580,19 @@ def setup_uvs(objects):
     logger.log("--- UV Setup Complete ---")
 
 
+# None = not tried yet, False = export failed once (no GPU), skip further attempts
+uv_layout_export_available = None
+
 def export_uv_layout(obj, uv_layer_name, output_filename):
     """Export UV layout as image for visual verification"""
+    global uv_layout_export_available
+
+    # The exporter add-on must be enabled, and it needs a GPU context
+    if uv_layout_export_available is None and 'io_mesh_uv_layout' not in bpy.context.preferences.addons:
+        uv_layout_export_available = False
+    if uv_layout_export_available is False:
+        return False
+
     logger.log(f"  Trying to export '{uv_layer_name}'...")
 
     # Ensure object is selected and active
@@ -517,7 +604,7 @@ def export_uv_layout(obj, uv_layer_name, output_filename):
     if uv_layer_name in obj.data.uv_layers:
         obj.data.uv_layers[uv_layer_name].active = True
     else:
-        logger.log(f"    ❌ UV layer '{uv_layer_name}' not found!")
+        logger.log(f"    ❌ UV layer '{uv_layer_name}' not found!", WARN)
         return False
 
     # Enter edit mode
@@ -535,10 +622,12 @@ def export_uv_layout(obj, uv_layer_name, output_filename):
         )
         logger.log(f"    ✅ Exported to: {output_path}")
         bpy.ops.object.mode_set(mode='OBJECT')
+        uv_layout_export_available = True
         return True
     except Exception as e:
         # Silently fail if GPU not available (common in script mode)
         bpy.ops.object.mode_set(mode='OBJECT')
+        uv_layout_export_available = False
         return False
 
 
@@ -547,14 +636,13 @@ def ensure_uv1_exists(objects):
     logger.log("\n--- Verifying UV1 (UVMap) on All Objects ---")
 
     missing_uv1 = []
-    for obj in objects:
-        if obj.type != 'MESH':
-            continue
-
+    mesh_objects = [obj for obj in objects if obj.type == 'MESH']
+    for obj in mesh_objects:
         # Ensure at least one UV layer exists
-        if len(obj.data.uv_layers) == 0:
-            logger.log(f"  ⚠️ {obj.name} has NO UV layers! Creating default UVMap...")
-            obj.data.uv_layers.new(name="UVMap")
+        uv_layers = obj.data.uv_layers
+        if len(uv_layers) == 0:
+            logger.log(f"  ⚠️ {obj.name} has NO UV layers! Creating default UVMap...", WARN)
+            uv_layers.new(name="UVMap")
             missing_uv1.append(obj.name)
 
     if missing_uv1:
@@ -565,6 +653,22 @@ def ensure_uv1_exists(objects):
     logger.log("--- UV1 Verification Complete ---")
 
 
+def loop_position_keys(mesh):
+    """
+    Per-loop vertex positions rounded to 5 decimals, packed as one
+    hashable row key per loop so lookups can be done with NumPy.
+    """
+    coords = np.empty(len(mesh.vertices) * 3, dtype=np.float32)
+    mesh.vertices.foreach_get("co", coords)
+    quantized = np.round(coords.astype(np.float64) * 1e5).astype(np.int64).reshape(-1, 3)
+
+    loop_verts = np.empty(len(mesh.loops), dtype=np.int32)
+    mesh.loops.foreach_get("vertex_index", loop_verts)
+
+    rows = np.ascontiguousarray(quantized[loop_verts])
+    return rows.view(np.dtype((np.void, rows.dtype.itemsize * 3))).ravel()
+
+
 def transfer_lightmap_uvs_fast(baked_object, original_objects):
     """
     FAST UV transfer using direct vertex position mapping.
@@ -573,14 +677,14 @@ def transfer_lightmap_uvs_fast(baked_object, original_objects):
     logger.log("\n--- Transferring Lightmap UVs (FAST METHOD) ---")
 
     if not baked_object:
-        logger.log("  ❌ ERROR: No baked object provided!")
+        logger.log("  ❌ ERROR: No baked object provided!", WARN)
         return
 
     source_mesh = baked_object.data
 
     # Verify source has lightmap UVs
     if LIGHTMAP_UV_NAME not in source_mesh.uv_layers:
-        logger.log(f"  ❌ ERROR: Baked object has no '{LIGHTMAP_UV_NAME}' layer!")
+        logger.log(f"  ❌ ERROR: Baked object has no '{LIGHTMAP_UV_NAME}' layer!", WARN)
         return
 
     logger.log(f"  Source: {baked_object.name} (has {LIGHTMAP_UV_NAME})")
@@ -588,23 +692,15 @@ def transfer_lightmap_uvs_fast(baked_object, original_objects):
 
     # Get source UV data
     source_uv_layer = source_mesh.uv_layers[LIGHTMAP_UV_NAME]
+    source_uvs = np.empty(len(source_uv_layer.data) * 2, dtype=np.float32)
+    source_uv_layer.data.foreach_get("uv", source_uvs)
+    source_uvs = source_uvs.reshape(-1, 2)
 
-    # Build vertex position → UV mapping from source
-    vert_to_uv = {}
-    for poly in source_mesh.polygons:
-        for loop_idx in poly.loop_indices:
-            loop = source_mesh.loops[loop_idx]
-            vert_idx = loop.vertex_index
-            vert_co = source_mesh.vertices[vert_idx].co
+    # Build sorted vertex position → UV table from source (first loop wins)
+    table_keys, first_loops = np.unique(loop_position_keys(source_mesh), return_index=True)
+    table_uvs = source_uvs[first_loops]
 
-            # Use position as key (rounded for matching)
-            key = (round(vert_co.x, 5), round(vert_co.y, 5), round(vert_co.z, 5))
-            uv = source_uv_layer.data[loop_idx].uv
-
-            if key not in vert_to_uv:
-                vert_to_uv[key] = uv.copy()
-
-    logger.log(f"  Built lookup table: {len(vert_to_uv)} unique vertices")
+    logger.log(f"  Built lookup table: {len(table_keys)} unique vertices")
 
     total_objects = len(original_objects)
     transferred = 0
@@ -622,23 +718,25 @@ def transfer_lightmap_uvs_fast(baked_object, original_objects):
         target_uv = mesh.uv_layers[LIGHTMAP_UV_NAME]
 
         # Copy UVs by matching vertex positions
-        for poly in mesh.polygons:
-            for loop_idx in poly.loop_indices:
-                loop = mesh.loops[loop_idx]
-                vert = mesh.vertices[loop.vertex_index]
-
-                key = (round(vert.co.x, 5), round(vert.co.y, 5), round(vert.co.z, 5))
-
-                if key in vert_to_uv:
-                    target_uv.data[loop_idx].uv = vert_to_uv[key]
+        loop_count = len(mesh.loops)
+        if loop_count > 0 and len(table_keys) > 0:
+            keys = loop_position_keys(mesh)
+            rows = np.minimum(np.searchsorted(table_keys, keys), len(table_keys) - 1)
+            matched = table_keys[rows] == keys
+
+            target_uvs = np.empty(loop_count * 2, dtype=np.float32)
+            target_uv.data.foreach_get("uv", target_uvs)
+            target_uvs = target_uvs.reshape(-1, 2)
+            target_uvs[matched] = table_uvs[rows[matched]]
+            target_uv.data.foreach_set("uv", target_uvs.ravel())
 
         # Set as active render UV
         mesh.uv_layers[LIGHTMAP_UV_NAME].active_render = True
         transferred += 1
 
         # Progress (less frequent for speed)
-        if idx % 100 == 0 or idx == total_objects:
-            logger.log(f"    Progress: {idx}/{total_objects} ({(idx/total_objects*100):.1f}%)")
+        if logger.enabled(DEBUG) and (idx % 100 == 0 or idx == total_objects):
+            logger.log(f"    Progress: {idx}/{total_objects} ({(idx/total_objects*100):.1f}%)", DEBUG)
 
     logger.log(f"\n  ✅ UV transfer complete! {transferred}/{total_objects} objects")
     logger.log(f"  ⚡ Fast method complete (seconds vs minutes)")
@@ -650,14 +748,14 @@ def transfer_lightmap_uvs(baked_object, original_objects):
     logger.log("\n--- Transferring Lightmap UVs (Data Transfer Modifier) ---")
 
     if not baked_object:
-        logger.log("  ❌ ERROR: No baked object provided!")
+        logger.log("  ❌ ERROR: No baked object provided!", WARN)
         return
 
     source_object = baked_object
 
     # Verify source has lightmap UVs
     if LIGHTMAP_UV_NAME not in source_object.data.uv_layers:
-        logger.log(f"  ❌ ERROR: Baked object has no '{LIGHTMAP_UV_NAME}' layer!")
+        logger.log(f"  ❌ ERROR: Baked object has no '{LIGHTMAP_UV_NAME}' layer!", WARN)
         return
 
     logger.log(f"  Source: {source_object.name} (has {LIGHTMAP_UV_NAME})")
@@ -669,6 +767,9 @@ def transfer_lightmap_uvs(baked_object, original_objects):
     successfully_transferred = 0
     failed_transfers = []
 
+    view_layer_objects = bpy.context.view_layer.objects
+    modifier_apply = bpy.ops.object.modifier_apply
+
     for idx, orig_obj in enumerate(original_objects, 1):
         if not orig_obj or orig_obj.type != 'MESH':
             continue
@@ -679,7 +780,7 @@ def transfer_lightmap_uvs(baked_object, original_objects):
 
         # Select and make active
         orig_obj.select_set(True)
-        bpy.context.view_layer.objects.active = orig_obj
+        view_layer_objects.active = orig_obj
 
         # Add Data Transfer modifier
         modifier = orig_obj.modifiers.new(name="LightmapUVTransfer", type='DATA_TRANSFER')
@@ -698,35 +799,35 @@ def transfer_lightmap_uvs(baked_object, original_objects):
 
             # Apply modifier
             try:
-                bpy.ops.object.modifier_apply(modifier=modifier.name)
+                modifier_apply(modifier=modifier.name)
 
                 # Set as active render
                 orig_obj.data.uv_layers[LIGHTMAP_UV_NAME].active_render = True
 
                 successfully_transferred += 1
             except RuntimeError as e:
-                logger.log(f"  ⚠️ Failed on {orig_obj.name}: {e}")
+                logger.log(f"  ⚠️ Failed on {orig_obj.name}: {e}", WARN)
                 failed_transfers.append(orig_obj.name)
                 # Remove failed modifier
                 if modifier.name in orig_obj.modifiers:
                     orig_obj.modifiers.remove(modifier)
         else:
-            logger.log(f"  ⚠️ UV layer mismatch on {orig_obj.name}")
+            logger.log(f"  ⚠️ UV layer mismatch on {orig_obj.name}", WARN)
             failed_transfers.append(orig_obj.name)
             orig_obj.modifiers.remove(modifier)
 
         orig_obj.select_set(False)
 
         # Progress logging
-        if idx % 50 == 0 or idx == total_objects:
-            logger.log(f"    Progress: {idx}/{total_objects} objects ({(idx/total_objects*100):.1f}%)")
+        if logger.enabled(DEBUG) and (idx % 50 == 0 or idx == total_objects):
+            logger.log(f"    Progress: {idx}/{total_objects} objects ({(idx/total_objects*100):.1f}%)", DEBUG)
 
     logger.log(f"\n  ✅ UV transfer complete! Transferred to {successfully_transferred}/{total_objects} objects")
 
     if failed_transfers:
-        logger.log(f"  ⚠️ Failed transfers ({len(failed_transfers)}): {', '.join(failed_transfers[:10])}")
+        logger.log(f"  ⚠️ Failed transfers ({len(failed_transfers)}): {', '.join(failed_transfers[:10])}", WARN)
         if len(failed_transfers) > 10:
-            logger.log(f"       ... and {len(failed_transfers)-10} more")
+            logger.log(f"       ... and {len(failed_transfers)-10} more", WARN)
 
     logger.log("--- UV Transfer Complete ---")
 
@@ -737,15 +838,13 @@ def verify_and_fix_uv2(objects):
 
     missing_uv2 = []
     fixed_uv2 = []
+    mesh_objects = [obj for obj in objects if obj.type == 'MESH']
 
-    for obj in objects:
-        if obj.type != 'MESH':
-            continue
-
+    for obj in mesh_objects:
         # Check if UV2 exists
         if LIGHTMAP_UV_NAME not in obj.data.uv_layers:
             missing_uv2.append(obj.name)
-            logger.log(f"  ⚠️ {obj.name} is MISSING {LIGHTMAP_UV_NAME}!")
+            logger.log(f"  ⚠️ {obj.name} is MISSING {LIGHTMAP_UV_NAME}!", WARN)
 
             # FALLBACK: Copy UV1 to UV2
             if len(obj.data.uv_layers) > 0:
@@ -759,8 +858,9 @@ def verify_and_fix_uv2(objects):
                 uv2.active_render = True
 
                 # Copy UV1 data to UV2
-                for loop_idx, loop in enumerate(obj.data.loops):
-                    uv2.data[loop_idx].uv = uv1.data[loop_idx].uv
+                uv_buffer = np.empty(len(obj.data.loops) * 2, dtype=np.float32)
+                uv1.data.foreach_get("uv", uv_buffer)
+                uv2.data.foreach_set("uv", uv_buffer)
 
                 fixed_uv2.append(obj.name)
                 logger.log(f"     ✅ Fixed {obj.name} by copying UV1 to UV2")
@@ -770,7 +870,7 @@ def verify_and_fix_uv2(objects):
             uv2.active_render = True
 
     logger.log(f"\n📊 UV2 Verification Results:")
-    logger.log(f"  Total mesh objects: {len([o for o in objects if o.type == 'MESH'])}")
+    logger.log(f"  Total mesh objects: {len(mesh_objects)}")
     logger.log(f"  Missing UV2: {len(missing_uv2)}")
     logger.log(f"  Fixed with fallback: {len(fixed_uv2)}")
 
@@ -784,11 +884,32 @@ def verify_and_fix_uv2(objects):
     elif len(fixed_uv2) == len(missing_uv2):
         logger.log(f"  ✅ All missing UV2s were fixed with fallback")
     else:
-        logger.log(f"  ⚠️ Some objects still missing UV2!")
+        logger.log(f"  ⚠️ Some objects still missing UV2!", WARN)
 
     logger.log("--- UV2 Verification Complete ---")
 
 
+def iter_unique_materials(objects):
+    """Yield each material used by the given mesh objects once, however many slots share it"""
+    seen = set()
+    for obj in objects:
+        if obj.type != 'MESH':
+            continue
+        for slot in obj.material_slots:
+            material = slot.material
+            if material and material.as_pointer() not in seen:
+                seen.add(material.as_pointer())
+                yield material
+
+
+def is_lightmap_image_node(node):
+    """True for Image Texture nodes holding one of the baked lightmaps"""
+    if node.bl_idname != 'ShaderNodeTexImage' or not node.image:
+        return False
+    image_name = node.image.name
+    return image_name in {'Mansion_Lightmap_On', 'Mansion_Lightmap_Off'} or 'Lightmap' in image_name
+
+
 def clean_lightmap_nodes_from_materials(objects):
     """Remove lightmap image nodes from materials to prevent GLTF export conflicts"""
     logger.log("\n--- Cleaning Lightmap Image Nodes from Materials ---")
@@ -796,30 +917,22 @@ def clean_lightmap_nodes_from_materials(objects):
     cleaned_count = 0
     total_materials = 0
 
-    for obj in objects:
-        if obj.type != 'MESH':
+    for material in iter_unique_materials(objects):
+        if not material.use_nodes:
             continue
 
-        for slot in obj.material_slots:
-            if not slot.material or not slot.material.use_nodes:
-                continue
+        total_materials += 1
+        nodes = material.node_tree.nodes
 
-            total_materials += 1
-            material = slot.material
-            nodes_to_remove = []
-
-            # Find all Image Texture nodes with lightmap images
-            for node in material.node_tree.nodes:
-                if node.type == 'ShaderNodeTexImage':
-                    if node.image and ('Lightmap' in node.image.name or
-                                      node.image.name == 'Mansion_Lightmap_On' or
-                                      node.image.name == 'Mansion_Lightmap_Off'):
-                        nodes_to_remove.append(node)
+        # Find all Image Texture nodes with lightmap images
+        nodes_to_remove = [node for node in nodes if is_lightmap_image_node(node)]
+        if not nodes_to_remove:
+            continue
 
-            # Remove the nodes
-            for node in nodes_to_remove:
-                material.node_tree.nodes.remove(node)
-                cleaned_count += 1
+        # Remove the nodes in one sweep; the tree is only re-evaluated on the next depsgraph update
+        for node in nodes_to_remove:
+            nodes.remove(node)
+        cleaned_count += len(nodes_to_remove)
 
     logger.log(f"  ✅ Removed {cleaned_count} lightmap image nodes from {total_materials} materials")
     logger.log("  This prevents 'Custom UV set 1' warnings in Three.js")
@@ -833,32 +946,21 @@ def export_mansion_glb():
     # Get the Mansion collection
     mansion_collection = bpy.data.collections.get(MANSION_COLLECTION_NAME)
     if not mansion_collection:
-        logger.log(f"  ❌ ERROR: Collection '{MANSION_COLLECTION_NAME}' not found!")
+        logger.log(f"  ❌ ERROR: Collection '{MANSION_COLLECTION_NAME}' not found!", WARN)
         return False
 
     # CRITICAL: Clean lightmap nodes from materials before export
     # This prevents Three.js GLTFLoader from trying to use TEXCOORD_1 for textures
-    all_mansion_objects = []
-    def collect_objects(collection):
-        for obj in collection.objects:
-            all_mansion_objects.append(obj)
-        for child_coll in collection.children:
-            collect_objects(child_coll)
-
-    collect_objects(mansion_collection)
+    # all_objects is Blender's cached flattening of the collection tree
+    all_mansion_objects = list(mansion_collection.all_objects)
     clean_lightmap_nodes_from_materials(all_mansion_objects)
 
     # Deselect all objects first
     bpy.ops.object.select_all(action='DESELECT')
 
     # Select all objects in the Mansion collection (recursively)
-    def select_collection_objects(collection):
-        for obj in collection.objects:
-            obj.select_set(True)
-        for child_coll in collection.children:
-            select_collection_objects(child_coll)
-
-    select_collection_objects(mansion_collection)
+    for obj in all_mansion_objects:
+        obj.select_set(True)
 
     # Count selected objects
     selected_count = len(bpy.context.selected_objects)
@@ -872,6 +974,7 @@ def export_mansion_glb():
     logger.log("  Exporting GLB with optimized settings...")
 
     try:
+        start_time = time.time()
         bpy.ops.export_scene.gltf(
             filepath=export_path,
             export_format='GLB',
@@ -897,10 +1000,17 @@ def export_mansion_glb():
             export_yup=True,  # Use Y-up orientation for Three.js
 
             # Compression (optional, but good for web)
-            export_draco_mesh_compression_enable=False,  # Disable for compatibility
+            export_draco_mesh_compression_enable=EXPORT_USE_DRACO,
+            export_draco_mesh_compression_level=DRACO_COMPRESSION_LEVEL,
+            export_draco_position_quantization=DRACO_POSITION_QUANTIZATION,
+            export_draco_normal_quantization=DRACO_NORMAL_QUANTIZATION,
+            export_draco_texcoord_quantization=DRACO_TEXCOORD_QUANTIZATION,
+            export_draco_generic_quantization=DRACO_GENERIC_QUANTIZATION,
         )
+        export_seconds = time.time() - start_time
 
         logger.log(f"  ✅ GLB exported successfully to: {export_path}")
+        logger.log(f"  Export took {export_seconds:.2f} seconds")
 
         # Get file size for logging
         file_size = os.path.getsize(export_path) / (1024 * 1024)  # Convert to MB
@@ -909,20 +1019,130 @@ def export_mansion_glb():
         return True
 
     except Exception as e:
-        logger.log(f"  ❌ Export failed: {e}")
+        logger.log(f"  ❌ Export failed: {e}", WARN)
         return False
 
     logger.log("--- GLB Export Complete ---")
 
 
-def perform_bake(objects, image_name, lights_on_collection, lights_off_collection):
+def collect_bake_light_targets(lights_on_collection, lights_off_collection):
+    """
+    Capture every light energy and emission strength the bakes toggle, with
+    its original value, in one pass over both light collections.
+
+    Returns a list of (target, attribute, original_value, in_on_collection).
+    Each light datablock / emission node appears once; if it is shared by
+    both collections, Lights_OFF wins as it did before.
+    """
+    targets = {}
+    for collection, in_on_collection in ((lights_on_collection, True), (lights_off_collection, False)):
+        for obj in collection.all_objects:
+            if obj.type == 'LIGHT' and hasattr(obj.data, 'energy'):
+                key = obj.data.as_pointer()
+                original = targets[key][2] if key in targets else obj.data.energy
+                targets[key] = (obj.data, 'energy', original, in_on_collection)
+
+            # Also handle emissive meshes
+            if obj.type == 'MESH' and obj.material_slots:
+                for slot in obj.material_slots:
+                    if slot.material and slot.material.use_nodes:
+                        for node in slot.material.node_tree.nodes:
+                            if node.type == 'EMISSION' and len(node.inputs) > 1:
+                                key = node.as_pointer()
+                                strength = node.inputs[1]
+                                original = targets[key][2] if key in targets else strength.default_value
+                                targets[key] = (strength, 'default_value', original, in_on_collection)
+
+    return list(targets.values())
+
+
+def restore_bake_light_targets(light_targets):
+    """Put back the light energies and emission strengths captured before baking"""
+    for target, attribute, original_value, _ in light_targets:
+        setattr(target, attribute, original_value)
+
+
+def get_emissive_materials(materials):
+    """Pointers of the node materials containing an Emission node, one tree walk per material"""
+    return {
+        material.as_pointer()
+        for material in materials
+        if material.use_nodes and material.node_tree
+        and any(node.type == 'EMISSION' for node in material.node_tree.nodes)
+    }
+
+
+def count_collection_lights(collection, emissive_materials):
+    """Return (light objects, emissive meshes) in a collection, in one walk"""
+    light_count = 0
+    emissive_count = 0
+    for obj in collection.all_objects:
+        if obj.type == 'LIGHT':
+            light_count += 1
+        elif obj.type == 'MESH' and any(
+            slot.material and slot.material.as_pointer() in emissive_materials
+            for slot in obj.material_slots
+        ):
+            emissive_count += 1
+    return light_count, emissive_count
+
+
+def enable_gpu_devices():
+    """
+    Enable every GPU Cycles can see. Setting scene.cycles.device = 'GPU'
+    alone is not enough: without enabled devices Cycles silently uses CPU.
+    Returns the compute device type used, or None if no GPU was found.
+    These are user preferences (auto-saved by Blender), so when no GPU is
+    found the original backend and device selection are put back.
+    """
+    cycles_addon = bpy.context.preferences.addons.get('cycles')
+    if not cycles_addon:
+        return None
+
+    prefs = cycles_addon.preferences
+    original_device_type = prefs.compute_device_type
+    original_device_use = {device.id: device.use for device in prefs.devices}
+
+    for device_type in ('OPTIX', 'CUDA', 'HIP', 'METAL', 'ONEAPI'):
+        try:
+            prefs.compute_device_type = device_type
+        except TypeError:
+            continue  # Not supported by this Blender build / platform
+
+        prefs.get_devices()
+        if any(device.type == device_type for device in prefs.devices):
+            for device in prefs.devices:
+                device.use = device.type != 'CPU'
+            return device_type
+
+    prefs.compute_device_type = original_device_type
+    prefs.get_devices()
+    for device in prefs.devices:
+        if device.id in original_device_use:
+            device.use = original_device_use[device.id]
+    return None
+
+
+def perform_bake(objects, image_name, light_targets, gpu_device_type=None, samples=None, denoise=None):
     logger.log(f"\n--- Starting Bake: {image_name} ---")
 
+    lights_on_pass = "On" in image_name
+    if samples is None:
+        samples = RENDER_SAMPLES if lights_on_pass else OFF_BAKE_SAMPLES
+    if denoise is None:
+        denoise = USE_DENOISE if lights_on_pass else OFF_BAKE_DENOISE
+
     scene = bpy.context.scene
     scene.render.engine = 'CYCLES'
-    scene.cycles.device = 'GPU'
-    scene.cycles.samples = RENDER_SAMPLES
-    scene.cycles.use_denoising = USE_DENOISE
+
+    if gpu_device_type:
+        scene.cycles.device = 'GPU'
+        logger.log(f"  🖥️ Baking on GPU ({gpu_device_type})")
+    else:
+        scene.cycles.device = 'CPU'
+        logger.log("  ⚠️ No GPU device found, baking on CPU", WARN)
+    scene.cycles.samples = samples
+    scene.cycles.use_denoising = denoise
     scene.cycles.denoiser = 'OPENIMAGEDENOISE'
     scene.cycles.max_bounces = MAX_LIGHT_BOUNCES
 
@@ -958,105 +1178,25 @@ def perform_bake(objects, image_name, lights_on_collection, lights_off_collectio
 
     logger.log(f"  ✅ World light: Strength={WORLD_LIGHT_STRENGTH}, Color={WORLD_LIGHT_COLOR}")
 
-    logger.log(f"  Render settings: {RENDER_SAMPLES} samples, Denoise: {USE_DENOISE}, Bounces: {MAX_LIGHT_BOUNCES}")
+    logger.log(f"  Render settings: {samples} samples, Denoise: {denoise}, Bounces: {MAX_LIGHT_BOUNCES}")
 
     # CRITICAL FIX: Actually disable lights by setting energy/emission strength to 0
-    # Store original values in dictionaries
+    # Original values were captured once by collect_bake_light_targets()
     logger.log(f"  Configuring lights for bake: {image_name}")
 
-    # Dictionary to store original light energies
-    original_light_energies = {}
-    original_emission_strengths = {}
-
-    if "On" in image_name:
-        # Turn ON lights in Lights_ON collection
-        for obj in lights_on_collection.all_objects:
-            if obj.type == 'LIGHT' and hasattr(obj.data, 'energy'):
-                # Store original if not already stored
-                if obj.name not in original_light_energies:
-                    original_light_energies[obj.name] = obj.data.energy
-                # Restore original energy
-                obj.data.energy = original_light_energies[obj.name]
-            # Also handle emissive meshes
-            if obj.type == 'MESH' and obj.material_slots:
-                for slot_idx, slot in enumerate(obj.material_slots):
-                    if slot.material and slot.material.use_nodes:
-                        for node_idx, node in enumerate(slot.material.node_tree.nodes):
-                            if node.type == 'EMISSION' and len(node.inputs) > 1:
-                                key = f"{obj.name}_{slot_idx}_{node_idx}"
-                                if key not in original_emission_strengths:
-                                    original_emission_strengths[key] = node.inputs[1].default_value
-                                node.inputs[1].default_value = original_emission_strengths[key]
-
-        # Turn OFF lights in Lights_OFF collection
-        for obj in lights_off_collection.all_objects:
-            if obj.type == 'LIGHT' and hasattr(obj.data, 'energy'):
-                # Store original if not already stored
-                if obj.name not in original_light_energies:
-                    original_light_energies[obj.name] = obj.data.energy
-                obj.data.energy = 0.0
-            # Also handle emissive meshes
-            if obj.type == 'MESH' and obj.material_slots:
-                for slot_idx, slot in enumerate(obj.material_slots):
-                    if slot.material and slot.material.use_nodes:
-                        for node_idx, node in enumerate(slot.material.node_tree.nodes):
-                            if node.type == 'EMISSION' and len(node.inputs) > 1:
-                                key = f"{obj.name}_{slot_idx}_{node_idx}"
-                                if key not in original_emission_strengths:
-                                    original_emission_strengths[key] = node.inputs[1].default_value
-                                node.inputs[1].default_value = 0.0
+    for target, attribute, original_value, in_on_collection in light_targets:
+        setattr(target, attribute, original_value if in_on_collection == lights_on_pass else 0.0)
 
+    if lights_on_pass:
         logger.log("  ✅ Lights ON collection enabled, Lights OFF collection disabled")
     else:
-        # Turn OFF lights in Lights_ON collection
-        for obj in lights_on_collection.all_objects:
-            if obj.type == 'LIGHT' and hasattr(obj.data, 'energy'):
-                if obj.name not in original_light_energies:
-                    original_light_energies[obj.name] = obj.data.energy
-                obj.data.energy = 0.0
-            if obj.type == 'MESH' and obj.material_slots:
-                for slot_idx, slot in enumerate(obj.material_slots):
-                    if slot.material and slot.material.use_nodes:
-                        for node_idx, node in enumerate(slot.material.node_tree.nodes):
-                            if node.type == 'EMISSION' and len(node.inputs) > 1:
-                                key = f"{obj.name}_{slot_idx}_{node_idx}"
-                                if key not in original_emission_strengths:
-                                    original_emission_strengths[key] = node.inputs[1].default_value
-                                node.inputs[1].default_value = 0.0
-
-        # Turn ON lights in Lights_OFF collection
-        for obj in lights_off_collection.all_objects:
-            if obj.type == 'LIGHT' and hasattr(obj.data, 'energy'):
-                if obj.name not in original_light_energies:
-                    original_light_energies[obj.name] = obj.data.energy
-                obj.data.energy = original_light_energies[obj.name]
-            if obj.type == 'MESH' and obj.material_slots:
-                for slot_idx, slot in enumerate(obj.material_slots):
-                    if slot.material and slot.material.use_nodes:
-                        for node_idx, node in enumerate(slot.material.node_tree.nodes):
-                            if node.type == 'EMISSION' and len(node.inputs) > 1:
-                                key = f"{obj.name}_{slot_idx}_{node_idx}"
-                                if key not in original_emission_strengths:
-                                    original_emission_strengths[key] = node.inputs[1].default_value
-                                node.inputs[1].default_value = original_emission_strengths[key]
-
         logger.log("  ✅ Lights OFF collection enabled, Lights ON collection disabled")
 
-    # Diagnostic: Count lights in each collection
-    on_lights = sum(1 for obj in lights_on_collection.all_objects if obj.type == 'LIGHT')
-    off_lights = sum(1 for obj in lights_off_collection.all_objects if obj.type == 'LIGHT')
-    on_emissive = sum(1 for obj in lights_on_collection.all_objects if obj.type == 'MESH' and any(
-        slot.material and slot.material.use_nodes and any(n.type == 'EMISSION' for n in slot.material.node_tree.nodes)
-        for slot in obj.material_slots))
-    off_emissive = sum(1 for obj in lights_off_collection.all_objects if obj.type == 'MESH' and any(
-        slot.material and slot.material.use_nodes and any(n.type == 'EMISSION' for n in slot.material.node_tree.nodes)
-        for slot in obj.material_slots))
-    logger.log(f"  Debug: Lights_ON has {on_lights} lights + {on_emissive} emissive meshes")
-    logger.log(f"  Debug: Lights_OFF has {off_lights} lights + {off_emissive} emissive meshes")
-
     logger.log(f"  Creating target image: '{image_name}' ({IMAGE_RESOLUTION}x{IMAGE_RESOLUTION})")
-    bpy.ops.image.new(name=image_name, width=IMAGE_RESOLUTION, height=IMAGE_RESOLUTION)
-    bake_image = bpy.data.images[image_name]
+    bake_image = bpy.data.images.new(
+        image_name, IMAGE_RESOLUTION, IMAGE_RESOLUTION,
+        alpha=True, float_buffer=OUTPUT_IMAGE_FORMAT == 'OPEN_EXR',
+    )
 
     logger.log("  Assigning target image node to all materials...")
     obj = objects[0]
@@ -1074,24 +1214,39 @@ def perform_bake(objects, image_name, lights_on_collection, lights_off_collectio
             image_node.image = bake_image
             nodes.active = image_node
 
-    logger.log("  Selecting the joined mesh for baking...")
-    bpy.ops.object.select_all(action='DESELECT')
-    obj.select_set(True)
-    bpy.context.view_layer.objects.active = obj
-
     logger.log("\n  >>> BAKING... This may take a while. Check the terminal for progress. <<<")
     start_time = time.time()
-    
-    bpy.ops.object.bake()
-    
+
+    # Hand the bake operator the joined mesh directly instead of
+    # rewriting the view layer selection before every bake
+    with bpy.context.temp_override(
+        scene=scene,
+        object=obj,
+        active_object=obj,
+        selected_objects=[obj],
+        selected_editable_objects=[obj],
+    ):
+        bpy.ops.object.bake(type='COMBINED')
+
     end_time = time.time()
     logger.log(f"  >>> BAKE COMPLETE! (Took { (end_time - start_time) / 60 :.2f} minutes) <<<")
 
-    output_path = os.path.join(output_directory, f"{image_name}.{OUTPUT_IMAGE_FORMAT.lower()}")
+    output_path = os.path.join(output_directory, f"{image_name}.{OUTPUT_IMAGE_EXTENSION}")
     logger.log(f"  Saving baked image to: {output_path}")
     bake_image.filepath_raw = output_path
-    bake_image.file_format = OUTPUT_IMAGE_FORMAT
-    bake_image.save()
+    if OUTPUT_IMAGE_FORMAT == 'OPEN_EXR':
+        # Image.save() always writes full float; save_render honours the half-float depth
+        image_settings = scene.render.image_settings
+        previous_format = (image_settings.file_format, image_settings.color_depth)
+        image_settings.file_format = 'OPEN_EXR'
+        image_settings.color_depth = '16'
+        try:
+            bake_image.save_render(output_path, scene=scene)
+        finally:
+            image_settings.file_format, image_settings.color_depth = previous_format
+    else:
+        bake_image.file_format = OUTPUT_IMAGE_FORMAT
+        bake_image.save()
     logger.log(f"--- Finished Bake: {image_name} ---")
 
 
@@ -1111,52 +1266,56 @@ def fix_texture_uv_assignments(objects):
     added_uvmap_nodes = 0
     total_materials = 0
 
-    for obj in objects:
-        if obj.type != 'MESH':
+    for material in iter_unique_materials(objects):
+        if not material.use_nodes:
             continue
 
-        for slot in obj.material_slots:
-            if not slot.material or not slot.material.use_nodes:
-                continue
-
-            total_materials += 1
-            material = slot.material
-            nodes = material.node_tree.nodes
-            links = material.node_tree.links
-
-            # Find all Image Texture nodes
-            for node in nodes:
-                if node.type == 'ShaderNodeTexImage':
-
-                    # Method 1: Check UV Map node connected to this texture
-                    vector_input = node.inputs.get('Vector')
-                    if vector_input and vector_input.links:
-                        for link in vector_input.links:
-                            if link.from_node.type == 'ShaderNodeUVMap':
-                                # Force it to use UV channel 0 (UVMap)
-                                if link.from_node.uv_map != 'UVMap':
-                                    logger.log(f"  Fixing {material.name}: UVMap node {link.from_node.uv_map} → UVMap")
-                                    link.from_node.uv_map = 'UVMap'
-                                    fixed_uvmap_nodes += 1
-
-                    # Method 2: If no UV Map node, add one and connect it
-                    elif vector_input and not vector_input.links:
-                        # Create UV Map node
-                        uvmap_node = nodes.new(type='ShaderNodeUVMap')
-                        uvmap_node.uv_map = 'UVMap'
-                        uvmap_node.location = (node.location.x - 300, node.location.y)
-
-                        # Connect it
-                        links.new(uvmap_node.outputs['UV'], node.inputs['Vector'])
-
-                        logger.log(f"  Added UVMap node to {material.name}")
-                        added_uvmap_nodes += 1
-
-                    # Method 3: Check if node has uv_map attribute (some node types)
-                    if hasattr(node, 'uv_map') and node.uv_map != 'UVMap' and node.uv_map != '':
-                        logger.log(f"  Fixing {material.name}: Image node uv_map {node.uv_map} → UVMap")
-                        node.uv_map = 'UVMap'
-                        fixed_image_nodes += 1
+        total_materials += 1
+        nodes = material.node_tree.nodes
+        links = material.node_tree.links
+
+        # Find all Image Texture nodes (snapshot, UV Map nodes are added below).
+        # Bake target nodes are skipped: export removes them, and wiring a
+        # UV Map node to them would leave orphans behind
+        tex_nodes = [
+            node for node in nodes
+            if node.bl_idname == 'ShaderNodeTexImage' and not is_lightmap_image_node(node)
+        ]
+        for node in tex_nodes:
+
+            # Method 1: Check UV Map node connected to this texture
+            vector_input = node.inputs.get('Vector')
+            vector_links = vector_input.links if vector_input else None
+            if vector_links:
+                for link in vector_links:
+                    from_node = link.from_node
+                    if from_node.bl_idname == 'ShaderNodeUVMap':
+                        # Force it to use UV channel 0 (UVMap)
+                        uv_map = from_node.uv_map
+                        if uv_map != 'UVMap':
+                            logger.log(f"  Fixing {material.name}: UVMap node {uv_map} → UVMap")
+                            from_node.uv_map = 'UVMap'
+                            fixed_uvmap_nodes += 1
+
+            # Method 2: If no UV Map node, add one and connect it
+            elif vector_input:
+                # Create UV Map node
+                uvmap_node = nodes.new(type='ShaderNodeUVMap')
+                uvmap_node.uv_map = 'UVMap'
+                uvmap_node.location = (node.location.x - 300, node.location.y)
+
+                # Connect it
+                links.new(uvmap_node.outputs['UV'], vector_input)
+
+                logger.log(f"  Added UVMap node to {material.name}")
+                added_uvmap_nodes += 1
+
+            # Method 3: Check if node has uv_map attribute (some node types)
+            node_uv_map = getattr(node, 'uv_map', None)
+            if node_uv_map and node_uv_map != 'UVMap':
+                logger.log(f"  Fixing {material.name}: Image node uv_map {node_uv_map} → UVMap")
+                node.uv_map = 'UVMap'
+                fixed_image_nodes += 1
 
     total_fixed = fixed_uvmap_nodes + fixed_image_nodes + added_uvmap_nodes
 
@@ -1220,14 +1379,33 @@ def main():
                     lights_off = child
 
     if not lights_on or not lights_off:
-        logger.log("Error: Could not find 'Lights_ON' or 'Lights_OFF' collections.")
-        logger.log(f"Available collections: {[c.name for c in bpy.data.collections]}")
+        logger.log("Error: Could not find 'Lights_ON' or 'Lights_OFF' collections.", WARN)
+        logger.log(f"Available collections: {[c.name for c in bpy.data.collections]}", WARN)
         return
 
     logger.log(f"Found light collections: {lights_on.name} and {lights_off.name}")
 
-    perform_bake(joined_mansion, "Mansion_Lightmap_On", lights_on, lights_off)
-    perform_bake(joined_mansion, "Mansion_Lightmap_Off", lights_on, lights_off)
+    # Capture original light values once, before either bake changes them
+    light_targets = collect_bake_light_targets(lights_on, lights_off)
+
+    # Diagnostic: Count lights in each collection (once, not per bake)
+    emissive_materials = get_emissive_materials(
+        iter_unique_materials(list(lights_on.all_objects) + list(lights_off.all_objects))
+    )
+    on_lights, on_emissive = count_collection_lights(lights_on, emissive_materials)
+    off_lights, off_emissive = count_collection_lights(lights_off, emissive_materials)
+    logger.log(f"  Debug: Lights_ON has {on_lights} lights + {on_emissive} emissive meshes")
+    logger.log(f"  Debug: Lights_OFF has {off_lights} lights + {off_emissive} emissive meshes")
+
+    # Enumerate and enable GPUs once for both bakes
+    gpu_device_type = enable_gpu_devices()
+
+    try:
+        perform_bake(joined_mansion, "Mansion_Lightmap_On", light_targets, gpu_device_type=gpu_device_type)
+        perform_bake(joined_mansion, "Mansion_Lightmap_Off", light_targets, gpu_device_type=gpu_device_type)
+    finally:
+        # Put the user's lights back even if a bake fails part-way
+        restore_bake_light_targets(light_targets)
 
     # STEP 4: Transfer correctly-sized UVs from joined mesh back to original objects
     # The joined mesh has proper surface-area-based UV islands
@@ -1249,7 +1427,7 @@ def main():
             if 0 <= first_uv[0] <= 1 and 0 <= first_uv[1] <= 1:
                 logger.log(f"  ✅ Original objects have correct lightmap UVs!")
             else:
-                logger.log(f"  ⚠️ UV coordinates out of range - transfer may have failed")
+                logger.log(f"  ⚠️ UV coordinates out of range - transfer may have failed", WARN)
     logger.log("")
 
     # Verify UV2 exists on all objects
@@ -1262,11 +1440,12 @@ def main():
 
     # Save the .blend file
     logger.log("\n💾 Saving .blend file...")
+    logger.flush()
     try:
         bpy.ops.wm.save_mainfile()  # Use save_mainfile instead of save_as_mainfile
         logger.log(f"✅ Saved to: {bpy.data.filepath}")
     except Exception as e:
-        logger.log(f"⚠️ Save warning: {e}")
+        logger.log(f"⚠️ Save warning: {e}", WARN)
         logger.log("   File may have been saved with @ suffix (backup issue)")
         logger.log("   You can manually save: File > Save or Ctrl+S")
 
@@ -1286,7 +1465,7 @@ def main():
     logger.log("✅ ALL TASKS COMPLETED SUCCESSFULLY!")
     logger.log("="*50)
     logger.log(f"📊 Summary:")
-    logger.log(f"   - Baked lightmaps: Mansion_Lightmap_On.png, Mansion_Lightmap_Off.png")
+    logger.log(f"   - Baked lightmaps: Mansion_Lightmap_On.{OUTPUT_IMAGE_EXTENSION}, Mansion_Lightmap_Off.{OUTPUT_IMAGE_EXTENSION}")
     logger.log(f"   - UV layouts exported: UV_Layout_UVMap.png, UV_Layout_LightmapUV.png")
     logger.log(f"   - UV layers verified and fixed on all {len(original_objects)} objects")
     if AUTO_EXPORT_GLB:
@@ -1297,7 +1476,8 @@ def main():
     logger.log(f"   - Image resolution: {IMAGE_RESOLUTION}x{IMAGE_RESOLUTION}")
     logger.log(f"   - Bake margin: {BAKE_MARGIN_PX}px")
     logger.log(f"   - UV island margin: {UV_ISLAND_MARGIN}")
-    logger.log(f"   - Samples: {RENDER_SAMPLES}")
+    logger.log(f"   - Lights ON bake: {RENDER_SAMPLES} samples, Denoise: {USE_DENOISE}")
+    logger.log(f"   - Lights OFF bake: {OFF_BAKE_SAMPLES} samples, Denoise: {OFF_BAKE_DENOISE}")
     logger.log("="*50)
     logger.log("\n🔍 UV Verification Steps:")
     if uv2_exported:
@@ -1309,9 +1489,10 @@ def main():
         logger.log("   3. Switch to 'UV Editing' workspace (top menu)")
         logger.log("   4. In UV Editor, select 'LightmapUV' from UV map dropdown")
         logger.log("   5. You should see proper UV islands, NOT jumbled overlapping lines")
-    logger.log("\n   📊 Check the log above for UV bounds and quality warnings")
-    logger.log("      - UV bounds should be roughly [0.000, 1.000]")
-    logger.log("      - Should say '✅ UV unwrap looks good'")
+    if VERIFY_UV_QUALITY:
+        logger.log("\n   📊 Check the log above for UV bounds and quality warnings")
+        logger.log("      - UV bounds should be roughly [0.000, 1.000]")
+        logger.log("      - Should say '✅ UV unwrap looks good'")
     logger.log("="*50)
 
 